@@ -1,11 +1,16 @@
-import json
+import asyncio
+import functools
+import mmap
 import os
 import random
+import struct
 from pathlib import Path
 from typing import Optional, Dict, Any
 
-import chess
+import numpy as np
+import orjson
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
 
@@ -16,17 +21,165 @@ def normalize_fen(fen: str) -> str:
     return " ".join(parts[:4])
 
 
-def weighted_choice(moves: Dict[str, int]) -> str:
-    # moves: {uci: count}
-    items = list(moves.items())
-    total = sum(c for _, c in items)
-    r = random.randint(1, total)
-    s = 0
-    for uci, c in items:
-        s += c
-        if r <= s:
-            return uci
-    return items[0][0]
+def prepare_entry(entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Turn a raw book entry {"total": N, "moves": {uci: count}} into the
+    precomputed form used by the handler:
+      ucis:  move UCIs sorted by count descending (also the fallback order)
+      cum:   cumulative counts aligned with ucis (for bisect sampling)
+      total: sum of counts
+      top / top_ratio: count and frequency of the most common move
+    Returns None for empty/degenerate entries.
+    """
+    moves = entry.get("moves", {})
+    if not moves:
+        return None
+    ordered = sorted(moves.items(), key=lambda kv: kv[1], reverse=True)
+    counts = np.fromiter((c for _, c in ordered), dtype=np.int64, count=len(ordered))
+    cum = np.cumsum(counts)
+    total = int(cum[-1])
+    if total <= 0:
+        return None
+    return {
+        "ucis": tuple(u for u, _ in ordered),
+        "top_uci": ordered[0][0],
+        "cum": cum,
+        "total": total,
+        "top": ordered[0][1],
+        "top_ratio": ordered[0][1] / float(total),
+    }
+
+
+# Reader for the packed binary book format written by tools/pack_book.py.
+# Layout (little-endian): header, meta JSON, open-addressed bucket array of
+# u64 record offsets keyed by FNV-1a hash of the normalized FEN, then flat
+# records (fen_hash u64, total u32, top_count u32, n_moves u16, moves as
+# uci u16 + count u32 pairs, count-descending).
+_BIN_MAGIC = b"CPBK"
+_BIN_HEADER = struct.Struct("<4sIQQI")
+_BIN_RECORD_HEADER = struct.Struct("<QIIH")
+_BIN_MOVE = struct.Struct("<HI")
+
+_FILES = "abcdefgh"
+_PROMOS = "nbrq"
+
+
+def _fnv1a64(data: bytes) -> int:
+    h = 0xCBF29CE484222325
+    for b in data:
+        h = ((h ^ b) * 0x100000001B3) & 0xFFFFFFFFFFFFFFFF
+    return h
+
+
+def _decode_uci(value: int) -> str:
+    frm = value & 0x3F
+    to = (value >> 6) & 0x3F
+    promo = (value >> 12) & 0x7
+    uci = (
+        _FILES[frm % 8] + str(frm // 8 + 1)
+        + _FILES[to % 8] + str(to // 8 + 1)
+    )
+    if promo:
+        uci += _PROMOS[promo - 1]
+    return uci
+
+
+class BinBook:
+    """
+    mmap'd opening book. Startup is O(1) (no JSON parse, no per-position
+    Python objects); lookup is one hash plus a few memory probes, decoding
+    an entry into the same dict shape prepare_entry produces.
+    """
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_buckets, n_entries, meta_len = _BIN_HEADER.unpack_from(self._mm, 0)
+        if magic != _BIN_MAGIC or version != 1:
+            raise ValueError(f"Not a packed opening book: {path}")
+        self._mask = n_buckets - 1
+        self._n_entries = n_entries
+        meta_off = _BIN_HEADER.size
+        self.meta = orjson.loads(self._mm[meta_off:meta_off + meta_len])
+        self._buckets_off = meta_off + meta_len
+        self._min_position_count = int(self.meta.get("min_position_count", 8))
+        self._min_top_move_ratio = float(self.meta.get("min_top_move_ratio", 0.55))
+
+    def __len__(self) -> int:
+        return self._n_entries
+
+    def __bool__(self) -> bool:
+        return self._n_entries > 0
+
+    def get(self, fen_key: str) -> Optional[Dict[str, Any]]:
+        mm = self._mm
+        h = _fnv1a64(fen_key.encode("utf-8"))
+        slot = h & self._mask
+        while True:
+            (off,) = struct.unpack_from("<Q", mm, self._buckets_off + 8 * slot)
+            if not off:
+                return None
+            rec_hash, total, top, n_moves = _BIN_RECORD_HEADER.unpack_from(mm, off)
+            if rec_hash == h:
+                break
+            slot = (slot + 1) & self._mask
+        if total <= 0:
+            return None
+        top_ratio = top / float(total)
+        status = _entry_status(total, top_ratio, self._min_position_count, self._min_top_move_ratio)
+        if status != "ok":
+            # Rejection needs no move list; skip the decode entirely
+            return {"status": status, "top_ratio": top_ratio}
+        ucis = []
+        counts = np.empty(n_moves, dtype=np.int64)
+        pos = off + _BIN_RECORD_HEADER.size
+        for i in range(n_moves):
+            uci16, count = _BIN_MOVE.unpack_from(mm, pos)
+            ucis.append(_decode_uci(uci16))
+            counts[i] = count
+            pos += _BIN_MOVE.size
+        return {
+            "status": status,
+            "ucis": tuple(ucis),
+            "top_uci": ucis[0],
+            "cum": np.cumsum(counts),
+            "total": total,
+            "top": top,
+            "top_ratio": top_ratio,
+        }
+
+
+@functools.lru_cache(maxsize=8192)
+def _legal_uci(fen_key: str) -> frozenset:
+    """
+    Legal-move UCI set for a normalized FEN key. Halfmove/fullmove counters
+    don't affect legality, so the normalized key is a safe cache key; book
+    positions are finite (thousands), so in steady state this hits the cache
+    and skips chess.Board construction + move generation entirely.
+
+    chess is imported here (not at module top) so the worker doesn't pay for
+    its attack/bitboard tables at startup; this only runs on cache misses.
+    """
+    import chess
+
+    return frozenset(m.uci() for m in chess.Board(fen_key + " 0 1").legal_moves)
+
+
+def weighted_choice(entry: Dict[str, Any]) -> str:
+    # Sample proportionally to counts: one uniform draw + binary search
+    # over the precomputed cumulative-count array.
+    i = np.searchsorted(entry["cum"], random.randrange(entry["total"]), side="right")
+    return entry["ucis"][i]
+
+
+def _entry_status(total: int, top_ratio: float, min_position_count: int, min_top_move_ratio: float) -> str:
+    # Decided once per entry at load/decode time; doubles as the /move
+    # response "source" on rejection.
+    if total < min_position_count:
+        return "below_min_count"
+    if top_ratio < min_top_move_ratio:
+        return "low_confidence"
+    return "ok"
 
 
 class MoveRequest(BaseModel):
@@ -35,102 +188,114 @@ class MoveRequest(BaseModel):
     mode: str = "capo298bot"
 
 
-class MoveResponse(BaseModel):
-    move: Optional[str]
-    source: str
-    confidence: float
-
-
 app = FastAPI()
 
 BOOK_PATH = Path(os.getenv("BOOK_PATH", "capo298_opening_book.json"))
 PROFILE_PATH = Path(os.getenv("PROFILE_PATH", "capo298bot_profile.json"))
 
 book: Dict[str, Any] = {}
-positions: Dict[str, Any] = {}
+positions: Any = {}  # dict of prepared entries, or a BinBook
 meta: Dict[str, Any] = {}
 profile: Dict[str, Any] = {}
+max_ply_cap = 20  # refreshed from book meta at load
+
+# FEN keys whose whole entry has been verified legal: book moves are legal
+# by construction, so after one verification per position the hot path
+# skips legal-move generation entirely. Bounded by the book size.
+_verified_fens: set = set()
 
 
 @app.on_event("startup")
 def load_artifacts():
-    global book, positions, meta, profile
+    global book, positions, meta, profile, max_ply_cap
     if BOOK_PATH.exists():
-        book = json.load(open(BOOK_PATH, "r", encoding="utf-8"))
-        meta = book.get("meta", {})
-        positions = book.get("positions", {})
+        if BOOK_PATH.suffix == ".bin":
+            # Packed book from tools/pack_book.py: mmap'd, nothing parsed up front
+            positions = BinBook(BOOK_PATH)
+            meta = positions.meta
+        else:
+            book = orjson.loads(BOOK_PATH.read_bytes())
+            meta = book.get("meta", {})
+            # Thresholds are fixed for a given book, so each entry's
+            # accept/reject outcome is decided here rather than per request
+            min_position_count = int(meta.get("min_position_count", 8))
+            min_top_move_ratio = float(meta.get("min_top_move_ratio", 0.55))
+            positions = {}
+            for fen_key, raw in book.get("positions", {}).items():
+                entry = prepare_entry(raw)
+                if entry is not None:
+                    entry["status"] = _entry_status(
+                        entry["total"], entry["top_ratio"], min_position_count, min_top_move_ratio
+                    )
+                    positions[fen_key] = entry
+        max_ply_cap = int(meta.get("max_ply_cap", 20))
         print(f"[move-service] Loaded book: {BOOK_PATH} positions={len(positions)}")
     else:
         print(f"[move-service] Book not found: {BOOK_PATH}")
 
     if PROFILE_PATH.exists():
-        profile = json.load(open(PROFILE_PATH, "r", encoding="utf-8"))
+        profile = orjson.loads(PROFILE_PATH.read_bytes())
         print(f"[move-service] Loaded profile: {PROFILE_PATH}")
     else:
         print(f"[move-service] Profile not found: {PROFILE_PATH}")
 
 
-@app.post("/move", response_model=MoveResponse)
-def get_move(req: MoveRequest):
-    # Validate FEN is legal-ish
-    try:
-        board = chess.Board(req.fen)
-    except Exception:
-        return MoveResponse(move=None, source="invalid_fen", confidence=0.0)
-
-    fen_key = normalize_fen(board.fen())
-    entry = positions.get(fen_key)
-    if not entry:
-        return MoveResponse(move=None, source="no_book_hit", confidence=0.0)
-
-    total = int(entry.get("total", 0))
-    moves = entry.get("moves", {})
-    if not moves or total <= 0:
-        return MoveResponse(move=None, source="empty_entry", confidence=0.0)
-
-    # Adaptive thresholds (from book meta; fallback to sane defaults)
-    min_position_count = int(meta.get("min_position_count", 8))
-    min_top_move_ratio = float(meta.get("min_top_move_ratio", 0.55))
-    max_ply_cap = int(meta.get("max_ply_cap", 20))
+# Plain dicts + ORJSONResponse on the hot path: no pydantic model
+# instantiation/validation per response (incoming MoveRequest validation
+# stays -- it is cheap and guards the handler).
+@app.post("/move", response_class=ORJSONResponse)
+async def get_move(req: MoveRequest):
+    # Syntactic FEN check only; no chess.Board on the hot path. Deeper
+    # invalidity just misses the book below (book keys are all valid FENs).
+    parts = req.fen.split()
+    if len(parts) < 2 or "/" not in parts[0]:
+        return {"move": None, "source": "invalid_fen", "confidence": 0.0}
 
     if req.ply >= max_ply_cap:
-        return MoveResponse(move=None, source="ply_cap", confidence=0.0)
+        return {"move": None, "source": "ply_cap", "confidence": 0.0}
 
-    # Top move ratio
-    top_move_count = max(moves.values())
-    top_ratio = top_move_count / float(total)
-
-    if total < min_position_count:
-        return MoveResponse(move=None, source="below_min_count", confidence=top_ratio)
+    fen_key = normalize_fen(req.fen)
+    entry = positions.get(fen_key)
+    if not entry:
+        return {"move": None, "source": "no_book_hit", "confidence": 0.0}
 
-    if top_ratio < min_top_move_ratio:
-        return MoveResponse(move=None, source="low_confidence", confidence=top_ratio)
+    top_ratio = entry["top_ratio"]
+    # Accept/reject was decided at load time (thresholds are per-book)
+    if entry["status"] != "ok":
+        return {"move": None, "source": entry["status"], "confidence": top_ratio}
 
     # Force deterministic first move from start position (optional)
     # STARTPOS = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -"
     # if fen_key == STARTPOS:
-    #     chosen = max(moves.items(), key=lambda kv: kv[1])[0]
+    #     chosen = entry["top_uci"]
     # else:
-    #     chosen = weighted_choice(moves)
+    #     chosen = weighted_choice(entry)
 
     # Choose a move weighted by frequency
-    chosen = weighted_choice(moves)
-
-    # Sanity: ensure chosen move is legal in this position; if not, try others
-    legal_uci = {m.uci() for m in board.legal_moves}
-    if chosen not in legal_uci:
-        # try highest-frequency legal move
-        for uci, _ in sorted(moves.items(), key=lambda kv: kv[1], reverse=True):
-            if uci in legal_uci:
-                chosen = uci
-                break
-        else:
-            return MoveResponse(move=None, source="no_legal_book_move", confidence=top_ratio)
+    chosen = weighted_choice(entry)
+
+    # Sanity: book moves can only be illegal here via FEN-key collisions
+    # after normalization. Verify the whole entry once per position; after
+    # that, hits skip legality checking altogether.
+    if fen_key not in _verified_fens:
+        # Board construction + move gen happen off the event loop; cached,
+        # so this thread hop occurs at most once per position
+        legal_uci = await asyncio.to_thread(_legal_uci, fen_key)
+        if all(u in legal_uci for u in entry["ucis"]):
+            _verified_fens.add(fen_key)
+        if chosen not in legal_uci:
+            # try highest-frequency legal move (ucis is already count-descending)
+            for uci in entry["ucis"]:
+                if uci in legal_uci:
+                    chosen = uci
+                    break
+            else:
+                return {"move": None, "source": "no_legal_book_move", "confidence": top_ratio}
 
-    return MoveResponse(move=chosen, source="opening_book", confidence=top_ratio)
+    return {"move": chosen, "source": "opening_book", "confidence": top_ratio}
 
 
-@app.get("/health")
+@app.get("/health", response_class=ORJSONResponse)
 def health():
     return {
         "ok": True,
@@ -1,52 +1,80 @@
-import json
+import os
 import zipfile
-from collections import defaultdict
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from io import StringIO
+from itertools import repeat
 from pathlib import Path
 import chess.pgn
+import orjson
 
 zip_path = Path("../data/pabloGames-20260224T115620Z-1-001.zip")
 
-e4_by_year = defaultdict(int)
-total_white_by_year = defaultdict(int)
 
-with zipfile.ZipFile(zip_path, "r") as zf:
-    for name in zf.namelist():
-        if not name.lower().endswith((".json", ".txt")):
+def count_file(zip_path, name):
+    """
+    Count capo298's games as White and their 1.e4 starts, per year, in one
+    export file. Files are independent, so this is the process-pool unit.
+    """
+    e4_by_year = Counter()
+    total_white_by_year = Counter()
+
+    with zipfile.ZipFile(zip_path, "r") as zf:
+        data = orjson.loads(zf.read(name).decode("utf-8", errors="replace"))
+
+    for g in data.get("games", []):
+        pgn_text = g.get("pgn")
+        if not pgn_text:
+            continue
+
+        # Cheap pre-filter before the expensive PGN parse: the quoted
+        # name must appear in the header block for White to match below
+        if '"capo298"' not in pgn_text[:400]:
+            continue
+
+        game = chess.pgn.read_game(StringIO(pgn_text))
+        if not game:
             continue
 
-        data = json.loads(zf.read(name).decode("utf-8", errors="replace"))
+        headers = game.headers
+        if headers.get("White") != "capo298":
+            continue
+
+        date = headers.get("Date", "")
+        if not date or "." not in date:
+            continue
+
+        year = date.split(".")[0]
+        total_white_by_year[year] += 1
+
+        first_move = next(iter(game.mainline_moves()), None)
+
+        if first_move and first_move.uci() == "e2e4":
+            e4_by_year[year] += 1
 
-        for g in data.get("games", []):
-            pgn_text = g.get("pgn")
-            if not pgn_text:
-                continue
+    return e4_by_year, total_white_by_year
 
-            game = chess.pgn.read_game(StringIO(pgn_text))
-            if not game:
-                continue
 
-            headers = game.headers
-            if headers.get("White") != "capo298":
-                continue
+def main():
+    with zipfile.ZipFile(zip_path, "r") as zf:
+        names = [n for n in zf.namelist() if n.lower().endswith((".json", ".txt"))]
 
-            date = headers.get("Date", "")
-            if not date or "." not in date:
-                continue
+    e4_by_year = Counter()
+    total_white_by_year = Counter()
 
-            year = date.split(".")[0]
-            total_white_by_year[year] += 1
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for e4, total in executor.map(count_file, repeat(zip_path), names):
+            e4_by_year.update(e4)
+            total_white_by_year.update(total)
 
-            board = game.board()
-            first_move = next(iter(game.mainline_moves()), None)
+    print("\n=== e4 usage by year ===\n")
 
-            if first_move and first_move.uci() == "e2e4":
-                e4_by_year[year] += 1
+    for year in sorted(total_white_by_year):
+        total = total_white_by_year[year]
+        e4 = e4_by_year[year]
+        pct = (e4 / total * 100) if total else 0
+        print(f"{year}: e4 = {e4}/{total} ({pct:.1f}%)")
 
-print("\n=== e4 usage by year ===\n")
 
-for year in sorted(total_white_by_year):
-    total = total_white_by_year[year]
-    e4 = e4_by_year[year]
-    pct = (e4 / total * 100) if total else 0
-    print(f"{year}: e4 = {e4}/{total} ({pct:.1f}%)")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,17 @@
 import argparse
-import json
+import gzip
+import io
+import multiprocessing
+import os
+import re
 import zipfile
-from collections import defaultdict
-from io import StringIO
+from collections import Counter, defaultdict
+from functools import partial
 from pathlib import Path
 
 import chess
-import chess.pgn
-from tqdm import tqdm
+import chess.polyglot
+import orjson
 
 
 def normalize_fen(fen: str) -> str:
@@ -23,25 +27,22 @@ def normalize_fen(fen: str) -> str:
 
 def iter_chesscom_games_from_zip(zip_path: Path):
     """
-    Yield each game dict from Chess.com monthly export JSON files inside a zip.
-    Expected file content: {"games": [ ...game objects... ]}
+    Yield each game's PGN string from Chess.com monthly export JSON files
+    inside a zip. Expected file content: {"games": [ ...game objects... ]}
+
+    Files are streamed one at a time, so peak memory is one month's export,
+    not the whole archive.
     """
     with zipfile.ZipFile(zip_path, "r") as zf:
         # Read only likely JSON-ish files
         names = [n for n in zf.namelist() if n.lower().endswith((".json", ".txt"))]
         for name in names:
-            with zf.open(name) as f:
-                raw = f.read()
-            # Try utf-8 with fallback
-            text = raw.decode("utf-8", errors="replace").strip()
-
-            if not text:
-                continue
-
-            # Some exports may have BOM or extra whitespace
+            # Some exports may have BOM, bad bytes, or extra whitespace
+            with zf.open(name, "r") as f:
+                text = f.read().decode("utf-8", errors="replace")
             try:
-                data = json.loads(text)
-            except json.JSONDecodeError:
+                data = orjson.loads(text)
+            except orjson.JSONDecodeError:
                 # If it isn't valid JSON, skip
                 continue
 
@@ -50,24 +51,255 @@ def iter_chesscom_games_from_zip(zip_path: Path):
                 continue
 
             for g in games:
-                if isinstance(g, dict) and "pgn" in g:
-                    yield g
+                if isinstance(g, dict) and isinstance(g.get("pgn"), str) and g["pgn"].strip():
+                    yield g["pgn"]
+
+
+def _split_pgn_stream(stream):
+    """
+    Yield one PGN string per game from a text stream of concatenated games.
+    A game ends when a new '[' header line follows movetext (a blank line
+    alone isn't enough: one also separates headers from movetext).
+    """
+    game_lines = []
+    in_movetext = False
+    for line in stream:
+        if line.startswith("["):
+            if in_movetext:
+                yield "".join(game_lines)
+                game_lines = []
+                in_movetext = False
+        elif line.strip():
+            in_movetext = True
+        game_lines.append(line)
+    if any(l.strip() for l in game_lines):
+        yield "".join(game_lines)
+
+
+def iter_pgns(path: Path):
+    """
+    Yield PGN strings from any supported games source:
+      .zip          Chess.com JSON exports ({"games": [...]} files)
+      .pgn          plain PGN file
+      .pgn.gz       gzip-compressed PGN, decompressed as a stream
+      .pgn.zst      zstandard-compressed PGN, decompressed as a stream
+                    (requires the 'zstandard' package)
+    Compressed PGN is streamed game by game, so memory stays at O(one
+    game) even for multi-GB dumps.
+    """
+    name = path.name.lower()
+    if name.endswith(".zip"):
+        yield from iter_chesscom_games_from_zip(path)
+    elif name.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit("Reading .zst inputs requires the 'zstandard' package (pip install zstandard).")
+        with open(path, "rb") as raw:
+            reader = zstandard.ZstdDecompressor().stream_reader(raw)
+            yield from _split_pgn_stream(io.TextIOWrapper(reader, encoding="utf-8", errors="replace"))
+    elif name.endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8", errors="replace") as stream:
+            yield from _split_pgn_stream(stream)
+    else:
+        with open(path, "r", encoding="utf-8", errors="replace") as stream:
+            yield from _split_pgn_stream(stream)
+
+
+_HEADER_RE = re.compile(r'^\[(White|Black|Date|FEN) "([^"]*)"\]', re.MULTILINE)
+_RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+
+
+def parse_pgn_prefix(pgn_text: str, max_plies: int):
+    """
+    Minimal PGN reader for book building: returns (headers, san_moves) where
+    headers holds only the tags we use and san_moves is the first max_plies
+    mainline SAN tokens. We only ever walk a short mainline prefix, so the
+    full chess.pgn parse (comments, clocks, NAGs, variations, game nodes)
+    is wasted work; comments/variations are dropped with a bracket-depth
+    scan and the scan stops as soon as enough moves are collected.
+    """
+    split = pgn_text.find("\n\n")
+    if split == -1:
+        header_block, movetext = pgn_text, ""
+    else:
+        header_block = pgn_text[:split]
+        movetext = pgn_text[split:]
+    headers = dict(_HEADER_RE.findall(header_block))
+
+    sans = []
+    depth = 0
+    token = ""
+    for ch in movetext + " ":
+        if depth:
+            if ch in "})":
+                depth -= 1
+            elif ch in "{(":
+                depth += 1
+            continue
+        if ch in "{(":
+            depth += 1
+            ch = " "  # brace opens mid-stream: treat as a token delimiter
+        if ch.isspace():
+            if token:
+                if "." in token:
+                    # "1." / "1..." / glued "1.e4" -> keep what follows the dot
+                    token = token.rsplit(".", 1)[1]
+                if token and token not in _RESULTS and not token.startswith("$"):
+                    sans.append(token)
+                token = ""
+                if len(sans) >= max_plies:
+                    break
+            continue
+        if ch in "})":
+            continue
+        token += ch
+
+    return headers, sans
+
+
+class ReplayBoard(chess.Board):
+    """
+    chess.Board specialized for forward-only game replay: push() applies the
+    move without snapshotting undo state (no _BoardState copy, no move_stack)
+    and without maintaining the halfmove/fullmove counters, which
+    normalize_fen drops and zobrist_hash ignores anyway. pop() is therefore
+    unsupported. The position-affecting logic mirrors chess.Board.push.
+    """
+
+    def push(self, move: chess.Move) -> None:
+        move = self._to_chess960(move)
+        self.castling_rights = self.clean_castling_rights()
+
+        # Reset en passant square.
+        ep_square = self.ep_square
+        self.ep_square = None
+
+        # On a null move, simply swap turns and reset the en passant square.
+        if not move:
+            self.turn = not self.turn
+            return
+
+        # Drops.
+        if move.drop:
+            self._set_piece_at(move.to_square, move.drop, self.turn)
+            self.turn = not self.turn
+            return
 
+        from_bb = chess.BB_SQUARES[move.from_square]
+        to_bb = chess.BB_SQUARES[move.to_square]
 
-def pgn_to_game(pgn_text: str):
+        promoted = bool(self.promoted & from_bb)
+        piece_type = self._remove_piece_at(move.from_square)
+        assert piece_type is not None
+        capture_square = move.to_square
+        captured_piece_type = self.piece_type_at(capture_square)
+
+        # Update castling rights.
+        self.castling_rights &= ~to_bb & ~from_bb
+        if piece_type == chess.KING and not promoted:
+            if self.turn == chess.WHITE:
+                self.castling_rights &= ~chess.BB_RANK_1
+            else:
+                self.castling_rights &= ~chess.BB_RANK_8
+        elif captured_piece_type == chess.KING and not self.promoted & to_bb:
+            if self.turn == chess.WHITE and chess.square_rank(move.to_square) == 7:
+                self.castling_rights &= ~chess.BB_RANK_8
+            elif self.turn == chess.BLACK and chess.square_rank(move.to_square) == 0:
+                self.castling_rights &= ~chess.BB_RANK_1
+
+        # Handle special pawn moves.
+        if piece_type == chess.PAWN:
+            diff = move.to_square - move.from_square
+            if diff == 16 and chess.square_rank(move.from_square) == 1:
+                self.ep_square = move.from_square + 8
+            elif diff == -16 and chess.square_rank(move.from_square) == 6:
+                self.ep_square = move.from_square - 8
+            elif move.to_square == ep_square and abs(diff) in [7, 9] and not captured_piece_type:
+                # Remove pawns captured en passant.
+                down = -8 if self.turn == chess.WHITE else 8
+                capture_square = ep_square + down
+                captured_piece_type = self._remove_piece_at(capture_square)
+
+        # Promotion.
+        if move.promotion:
+            promoted = True
+            piece_type = move.promotion
+
+        # Castling.
+        castling = piece_type == chess.KING and self.occupied_co[self.turn] & to_bb
+        if castling:
+            a_side = chess.square_file(move.to_square) < chess.square_file(move.from_square)
+
+            self._remove_piece_at(move.from_square)
+            self._remove_piece_at(move.to_square)
+
+            if a_side:
+                self._set_piece_at(chess.C1 if self.turn == chess.WHITE else chess.C8, chess.KING, self.turn)
+                self._set_piece_at(chess.D1 if self.turn == chess.WHITE else chess.D8, chess.ROOK, self.turn)
+            else:
+                self._set_piece_at(chess.G1 if self.turn == chess.WHITE else chess.G8, chess.KING, self.turn)
+                self._set_piece_at(chess.F1 if self.turn == chess.WHITE else chess.F8, chess.ROOK, self.turn)
+
+        # Put the piece on the target square.
+        if not castling:
+            was_promoted = bool(self.promoted & to_bb)
+            self._set_piece_at(move.to_square, piece_type, self.turn, promoted)
+
+            if captured_piece_type:
+                self._push_capture(move, capture_square, captured_piece_type, was_promoted)
+
+        # Swap turn.
+        self.turn = not self.turn
+
+
+# Per-worker-process memo of Zobrist keys whose normalized FEN has already
+# been reported to the parent; lets us skip the board.fen() string build on
+# every revisit of a known position.
+_seen_fens: dict = {}
+
+
+def _count_game(pgn_text: str, max_ply_cap: int):
     """
-    Parse PGN string into a python-chess Game object.
+    Pool worker: parse one PGN and count (key, uci) pairs along the mainline
+    up to the ply cap, where key is the 64-bit Zobrist hash of the position.
+    Also returns {key: normalized fen} for keys first seen by this worker,
+    so the parent can translate keys back for the output JSON.
     """
-    pgn_io = StringIO(pgn_text)
+    counts = {}  # flat (key, uci) -> count; plain dict.get beats Counter here
+    new_fens = {}
+    headers, sans = parse_pgn_prefix(pgn_text, max_ply_cap)
+
     try:
-        game = chess.pgn.read_game(pgn_io)
-        return game
-    except Exception:
-        return None
+        board = ReplayBoard(headers["FEN"]) if "FEN" in headers else ReplayBoard()
+    except ValueError:
+        return counts, new_fens
+
+    # Local bindings for the per-ply loop (also PyPy-friendly)
+    zobrist_hash = chess.polyglot.zobrist_hash
+    push_san = board.push_san
+    seen_fens = _seen_fens
+    counts_get = counts.get
+
+    for san in sans:
+        key = zobrist_hash(board)
+        if key not in seen_fens:
+            fen_key = normalize_fen(board.fen())
+            seen_fens[key] = fen_key
+            new_fens[key] = fen_key
+        try:
+            move = push_san(san)
+        except ValueError:
+            # Malformed/illegal SAN: drop the rest of this game
+            break
+        k = (key, move.uci())
+        counts[k] = counts_get(k, 0) + 1
+
+    return counts, new_fens
 
 
 def build_opening_book(
-    zip_path: Path,
+    games_path: Path,
     max_ply_cap: int,
     min_position_count: int,
     min_top_move_ratio: float,
@@ -80,48 +312,46 @@ def build_opening_book(
            "<normalized fen>": {"total": N, "moves": {"e2e4": c, ...}}
         }
       }
+
+    PGN parsing (the CPU-bound part) is fanned out over a process pool;
+    the parent streams PGNs out of the zip and merges per-game counters,
+    so peak memory stays at O(games in flight).
     """
-    move_counts = defaultdict(lambda: defaultdict(int))  # fen -> move_uci -> count
-    total_positions = defaultdict(int)  # fen -> total seen
+    move_counts = Counter()  # (zobrist key, uci) -> count
+    fen_by_key = {}  # zobrist key -> normalized fen
+    n_games = 0
 
-    games_iter = list(iter_chesscom_games_from_zip(zip_path))
-    if not games_iter:
+    worker = partial(_count_game, max_ply_cap=max_ply_cap)
+    with multiprocessing.Pool(processes=os.cpu_count()) as pool:
+        results = pool.imap_unordered(worker, iter_pgns(games_path), chunksize=64)
+        for game_counts, new_fens in results:
+            n_games += 1
+            # tqdm costs real time per iteration at this rate; a coarse
+            # manual progress line is enough
+            if (n_games & 0xFFFF) == 0:
+                print(f"Processed {n_games} games...", flush=True)
+            move_counts.update(game_counts)
+            fen_by_key.update(new_fens)
+
+    if not n_games:
         raise SystemExit(
-            "No games found in zip. Make sure the zip contains Chess.com JSON export files with a top-level 'games' array."
+            "No games found in input. For zips, make sure they contain Chess.com JSON export files with a top-level 'games' array."
         )
 
-    for g in tqdm(games_iter, desc="Processing games"):
-        pgn_text = g.get("pgn")
-        if not isinstance(pgn_text, str) or not pgn_text.strip():
-            continue
-
-        game = pgn_to_game(pgn_text)
-        if game is None:
-            continue
-
-        board = game.board()
-        ply = 0
-
-        for move in game.mainline_moves():
-            if ply >= max_ply_cap:
-                break
-
-            fen_key = normalize_fen(board.fen())
-            uci = move.uci()
-
-            total_positions[fen_key] += 1
-            move_counts[fen_key][uci] += 1
-
-            board.push(move)
-            ply += 1
+    # Build final output structure. Distinct keys can map to the same
+    # normalized FEN (Zobrist hashes the en-passant file only when a capture
+    # is possible), so merge with += rather than assignment.
+    by_fen = defaultdict(dict)  # fen -> move_uci -> count
+    total_positions = defaultdict(int)  # fen -> total seen
+    for (key, uci), count in move_counts.items():
+        moves = by_fen[fen_by_key[key]]
+        moves[uci] = moves.get(uci, 0) + count
+        total_positions[fen_by_key[key]] += count
 
-    # Build final output structure
     positions_out = {}
-    for fen_key, moves_dict in move_counts.items():
-        total = total_positions[fen_key]
-        # Convert nested defaultdict to normal dict
+    for fen_key, moves_dict in by_fen.items():
         positions_out[fen_key] = {
-            "total": total,
+            "total": total_positions[fen_key],
             "moves": dict(sorted(moves_dict.items(), key=lambda kv: kv[1], reverse=True)),
         }
 
@@ -140,26 +370,29 @@ def build_opening_book(
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--zip", required=True, help="Path to zip with Chess.com export files")
+    ap.add_argument("--zip", required=True, dest="games",
+                    help="Games source: Chess.com export zip, .pgn, .pgn.gz, or .pgn.zst")
     ap.add_argument("--out", default="capo298_opening_book.json", help="Output JSON path")
     ap.add_argument("--max-ply-cap", type=int, default=20, help="Maximum ply to record (safety cap)")
     ap.add_argument("--min-position-count", type=int, default=8, help="Adaptive: minimum occurrences to stay in book")
     ap.add_argument("--min-top-move-ratio", type=float, default=0.55, help="Adaptive: top move frequency threshold")
     args = ap.parse_args()
 
-    zip_path = Path(args.zip)
-    if not zip_path.exists():
-        raise SystemExit(f"Zip not found: {zip_path}")
+    games_path = Path(args.games)
+    if not games_path.exists():
+        raise SystemExit(f"Input not found: {games_path}")
 
     book = build_opening_book(
-        zip_path=zip_path,
+        games_path=games_path,
         max_ply_cap=args.max_ply_cap,
         min_position_count=args.min_position_count,
         min_top_move_ratio=args.min_top_move_ratio,
     )
 
+    # No indent: the production artifact is machine-read, and pretty-printing
+    # roughly doubles both the write and the service's load time.
     out_path = Path(args.out)
-    out_path.write_text(json.dumps(book, ensure_ascii=False, indent=2))
+    out_path.write_bytes(orjson.dumps(book))
     print(f"\nWrote opening book to: {out_path.resolve()}")
     print(f"Unique positions: {len(book['positions'])}")
 
@@ -1,13 +1,16 @@
 import argparse
-import json
+import gzip
+import io
+import re
 import zipfile
 from collections import defaultdict
-from io import StringIO
 from pathlib import Path
 
 import chess
-import chess.pgn
-from tqdm import tqdm
+import chess.polyglot
+import orjson
+
+from build_opening_book import ReplayBoard
 
 
 def normalize_fen(fen: str) -> str:
@@ -26,48 +29,143 @@ def iter_chesscom_games_from_zip(zip_path: Path):
             if not text:
                 continue
             try:
-                data = json.loads(text)
-            except json.JSONDecodeError:
+                data = orjson.loads(text)
+            except orjson.JSONDecodeError:
                 continue
             games = data.get("games")
             if not isinstance(games, list):
                 continue
             for g in games:
-                if isinstance(g, dict) and isinstance(g.get("pgn"), str):
-                    yield g
+                if isinstance(g, dict) and isinstance(g.get("pgn"), str) and g["pgn"].strip():
+                    yield g["pgn"]
+
+
+def _split_pgn_stream(stream):
+    """
+    Yield one PGN string per game from a text stream of concatenated games.
+    A game ends when a new '[' header line follows movetext (a blank line
+    alone isn't enough: one also separates headers from movetext).
+    """
+    game_lines = []
+    in_movetext = False
+    for line in stream:
+        if line.startswith("["):
+            if in_movetext:
+                yield "".join(game_lines)
+                game_lines = []
+                in_movetext = False
+        elif line.strip():
+            in_movetext = True
+        game_lines.append(line)
+    if any(l.strip() for l in game_lines):
+        yield "".join(game_lines)
+
 
+def iter_pgns(path: Path):
+    """
+    Yield PGN strings from a Chess.com export zip, a plain .pgn file, or a
+    .pgn.gz / .pgn.zst stream (the latter needs the 'zstandard' package).
+    Compressed PGN is decompressed incrementally: O(one game) memory.
+    """
+    name = path.name.lower()
+    if name.endswith(".zip"):
+        yield from iter_chesscom_games_from_zip(path)
+    elif name.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit("Reading .zst inputs requires the 'zstandard' package (pip install zstandard).")
+        with open(path, "rb") as raw:
+            reader = zstandard.ZstdDecompressor().stream_reader(raw)
+            yield from _split_pgn_stream(io.TextIOWrapper(reader, encoding="utf-8", errors="replace"))
+    elif name.endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8", errors="replace") as stream:
+            yield from _split_pgn_stream(stream)
+    else:
+        with open(path, "r", encoding="utf-8", errors="replace") as stream:
+            yield from _split_pgn_stream(stream)
 
-def pgn_to_game(pgn_text: str):
-    try:
-        return chess.pgn.read_game(StringIO(pgn_text))
-    except Exception:
-        return None
 
+_HEADER_RE = re.compile(r'^\[(White|Black|Date|FEN) "([^"]*)"\]', re.MULTILINE)
+_RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
 
-def build_opening_book(zip_path: Path, player: str, max_ply_cap: int):
-    # fen -> move_uci -> count
-    move_counts = defaultdict(lambda: defaultdict(int))
-    total_positions = defaultdict(int)
 
-    games = list(iter_chesscom_games_from_zip(zip_path))
-    if not games:
-        raise SystemExit("No games found in zip (expected Chess.com JSON exports with 'games' array).")
+def parse_pgn_prefix(pgn_text: str, max_plies: int):
+    """
+    Minimal PGN reader: (headers, san_moves) with only the tags we use and
+    the first max_plies mainline SAN tokens. Comments/variations/NAGs are
+    skipped with a bracket-depth scan instead of the full chess.pgn parse,
+    and scanning stops once enough moves are collected.
+    """
+    split = pgn_text.find("\n\n")
+    if split == -1:
+        header_block, movetext = pgn_text, ""
+    else:
+        header_block = pgn_text[:split]
+        movetext = pgn_text[split:]
+    headers = dict(_HEADER_RE.findall(header_block))
 
+    sans = []
+    depth = 0
+    token = ""
+    for ch in movetext + " ":
+        if depth:
+            if ch in "})":
+                depth -= 1
+            elif ch in "{(":
+                depth += 1
+            continue
+        if ch in "{(":
+            depth += 1
+            ch = " "
+        if ch.isspace():
+            if token:
+                if "." in token:
+                    token = token.rsplit(".", 1)[1]
+                if token and token not in _RESULTS and not token.startswith("$"):
+                    sans.append(token)
+                token = ""
+                if len(sans) >= max_plies:
+                    break
+            continue
+        if ch in "})":
+            continue
+        token += ch
+
+    return headers, sans
+
+
+def build_opening_book(games_path: Path, player: str, max_ply_cap: int):
+    # Flat (zobrist key, uci) -> count: one dict op per recorded ply instead
+    # of the nested-defaultdict double lookup + lambda factory.
+    move_counts = {}
+    fen_by_key = {}  # zobrist key -> normalized fen (for the output JSON)
+
+    seen = 0
     skipped = 0
     used = 0
 
-    for g in tqdm(games, desc="Processing games"):
-        pgn_text = g.get("pgn", "")
-        if not pgn_text.strip():
-            skipped += 1
-            continue
+    # Local bindings for the per-game loop (also PyPy-friendly)
+    zobrist_hash = chess.polyglot.zobrist_hash
+    WHITE = chess.WHITE
+    counts_get = move_counts.get
+    player_quoted = f'"{player}"'
 
-        game = pgn_to_game(pgn_text)
-        if game is None:
-            skipped += 1
+    for pgn_text in iter_pgns(games_path):
+        seen += 1
+        # tqdm costs real time per iteration at this rate; a coarse manual
+        # progress line is enough
+        if (seen & 0xFFFF) == 0:
+            print(f"Processed {seen} games...", flush=True)
+
+        # Cheap pre-filter: the quoted player name must appear in the header
+        # block (first few hundred bytes) for this to be one of their games;
+        # skip the whole parse otherwise.
+        if player_quoted not in pgn_text[:400]:
             continue
 
-        headers = game.headers
+        headers, sans = parse_pgn_prefix(pgn_text, max_ply_cap)
+
         white = headers.get("White", "")
         black = headers.get("Black", "")
 
@@ -77,37 +175,49 @@ def build_opening_book(zip_path: Path, player: str, max_ply_cap: int):
 
         player_is_white = (white == player)
 
-        board = game.board()
-        ply = 0
+        try:
+            board = ReplayBoard(headers["FEN"]) if "FEN" in headers else ReplayBoard()
+        except ValueError:
+            skipped += 1
+            continue
 
-        for move in game.mainline_moves():
-            if ply >= max_ply_cap:
-                break
+        push_san = board.push_san
 
+        for san in sans:
             # Only record moves where it's the player's turn to move
-            if board.turn == chess.WHITE:
-                if player_is_white:
-                    fen_key = normalize_fen(board.fen())
-                    uci = move.uci()
-                    total_positions[fen_key] += 1
-                    move_counts[fen_key][uci] += 1
-            else:
-                if not player_is_white:
-                    fen_key = normalize_fen(board.fen())
-                    uci = move.uci()
-                    total_positions[fen_key] += 1
-                    move_counts[fen_key][uci] += 1
-
-            board.push(move)
-            ply += 1
+            record = (board.turn == WHITE) == player_is_white
+            if record:
+                key = zobrist_hash(board)
+                if key not in fen_by_key:
+                    # board.fen() only on first sight of a position
+                    fen_by_key[key] = normalize_fen(board.fen())
+
+            try:
+                move = push_san(san)
+            except ValueError:
+                # malformed/illegal SAN: drop the rest of this game
+                break
+
+            if record:
+                k = (key, move.uci())
+                move_counts[k] = counts_get(k, 0) + 1
 
         used += 1
 
+    # Distinct keys can map to the same normalized FEN (Zobrist hashes the
+    # en-passant file only when a capture is possible), so merge with +=.
+    by_fen = defaultdict(dict)
+    fen_totals = defaultdict(int)
+    for (key, uci), count in move_counts.items():
+        fen_key = fen_by_key[key]
+        moves = by_fen[fen_key]
+        moves[uci] = moves.get(uci, 0) + count
+        fen_totals[fen_key] += count
+
     positions_out = {}
-    for fen_key, moves_dict in move_counts.items():
-        total = total_positions[fen_key]
+    for fen_key, moves_dict in by_fen.items():
         positions_out[fen_key] = {
-            "total": total,
+            "total": fen_totals[fen_key],
             "moves": dict(sorted(moves_dict.items(), key=lambda kv: kv[1], reverse=True)),
         }
 
@@ -119,25 +229,31 @@ def build_opening_book(zip_path: Path, player: str, max_ply_cap: int):
         "fen_format": "pieces side castling ep (no half/fullmove)",
     }
 
-    return {"meta": meta, "positions": positions_out, "stats": {"games_seen": len(games), "games_used": used, "games_skipped": skipped}}
+    if not seen:
+        raise SystemExit("No games found in input (for zips, expected Chess.com JSON exports with 'games' array).")
+
+    return {"meta": meta, "positions": positions_out, "stats": {"games_seen": seen, "games_used": used, "games_skipped": skipped}}
 
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--zip", required=True, help="Zip file with Chess.com exports")
+    ap.add_argument("--zip", required=True, dest="games",
+                    help="Games source: Chess.com export zip, .pgn, .pgn.gz, or .pgn.zst")
     ap.add_argument("--player", default="capo298", help="Username to model")
     ap.add_argument("--max-ply-cap", type=int, default=20, help="Max ply to record (safety cap)")
     ap.add_argument("--out", default="../data/capo298_opening_book_turnonly.json", help="Output JSON")
     args = ap.parse_args()
 
-    zip_path = Path(args.zip)
-    if not zip_path.exists():
-        raise SystemExit(f"Zip not found: {zip_path}")
+    games_path = Path(args.games)
+    if not games_path.exists():
+        raise SystemExit(f"Input not found: {games_path}")
 
-    book = build_opening_book(zip_path, args.player, args.max_ply_cap)
+    book = build_opening_book(games_path, args.player, args.max_ply_cap)
 
+    # No indent: the artifact is machine-read; pretty-printing roughly
+    # doubles the write and the load on the consumer side.
     out_path = Path(args.out)
-    out_path.write_text(json.dumps(book, ensure_ascii=False, indent=2), encoding="utf-8")
+    out_path.write_bytes(orjson.dumps(book))
     print(f"\nWrote: {out_path.resolve()}")
     print("Unique positions:", len(book["positions"]))
     print("Stats:", book["stats"])
@@ -0,0 +1,122 @@
+import argparse
+import struct
+from pathlib import Path
+
+import orjson
+
+# Binary opening-book format (little-endian):
+#
+#   header:  magic "CPBK", version u32, n_buckets u64, n_entries u64, meta_len u32
+#   meta:    meta_len bytes of UTF-8 JSON (the book's "meta" dict)
+#   buckets: n_buckets * u64 file offsets (0 = empty slot)
+#   records: per position:
+#              fen_hash u64, total u32, top_count u32, n_moves u16,
+#              then n_moves * (uci u16, count u32), count-descending
+#
+# Positions are keyed by a 64-bit FNV-1a hash of the normalized FEN and
+# placed in an open-addressed (linear probe) power-of-two bucket array,
+# so the service can mmap the file and look up a position with one hash
+# and a few memory probes -- no JSON parse, no per-entry Python objects.
+# total/top_count live in the record header so threshold rejection never
+# decodes the move list.
+
+MAGIC = b"CPBK"
+VERSION = 1
+HEADER = struct.Struct("<4sIQQI")
+RECORD_HEADER = struct.Struct("<QIIH")
+MOVE = struct.Struct("<HI")
+
+_FILES = "abcdefgh"
+_PROMOS = "nbrq"
+
+
+def fnv1a64(data: bytes) -> int:
+    h = 0xCBF29CE484222325
+    for b in data:
+        h = ((h ^ b) * 0x100000001B3) & 0xFFFFFFFFFFFFFFFF
+    return h
+
+
+def _square(name: str) -> int:
+    return (int(name[1]) - 1) * 8 + _FILES.index(name[0])
+
+
+def encode_uci(uci: str) -> int:
+    # from-square (6 bits) | to-square (6 bits) | promotion (3 bits)
+    promo = _PROMOS.index(uci[4]) + 1 if len(uci) > 4 else 0
+    return _square(uci[0:2]) | (_square(uci[2:4]) << 6) | (promo << 12)
+
+
+def decode_uci(value: int) -> str:
+    frm = value & 0x3F
+    to = (value >> 6) & 0x3F
+    promo = (value >> 12) & 0x7
+    uci = (
+        _FILES[frm % 8] + str(frm // 8 + 1)
+        + _FILES[to % 8] + str(to // 8 + 1)
+    )
+    if promo:
+        uci += _PROMOS[promo - 1]
+    return uci
+
+
+def pack_book(book: dict) -> bytes:
+    positions = book.get("positions", {})
+    meta_bytes = orjson.dumps(book.get("meta", {}))
+
+    n_buckets = 1
+    while n_buckets < 2 * max(len(positions), 1):
+        n_buckets *= 2
+    mask = n_buckets - 1
+
+    records_start = HEADER.size + len(meta_bytes) + 8 * n_buckets
+    buckets = [0] * n_buckets
+    records = bytearray()
+
+    for fen_key, entry in positions.items():
+        moves = entry.get("moves", {})
+        if not moves:
+            continue
+        ordered = sorted(moves.items(), key=lambda kv: kv[1], reverse=True)
+        total = sum(c for _, c in ordered)
+
+        h = fnv1a64(fen_key.encode("utf-8"))
+        slot = h & mask
+        while buckets[slot]:
+            slot = (slot + 1) & mask
+        buckets[slot] = records_start + len(records)
+
+        records += RECORD_HEADER.pack(h, total, ordered[0][1], len(ordered))
+        for uci, count in ordered:
+            records += MOVE.pack(encode_uci(uci), count)
+
+    out = bytearray()
+    out += HEADER.pack(MAGIC, VERSION, n_buckets, len(positions), len(meta_bytes))
+    out += meta_bytes
+    for off in buckets:
+        out += struct.pack("<Q", off)
+    out += records
+    return bytes(out)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--book", required=True, help="Input opening book JSON")
+    ap.add_argument("--out", default=None, help="Output .bin path (default: input with .bin suffix)")
+    args = ap.parse_args()
+
+    book_path = Path(args.book)
+    if not book_path.exists():
+        raise SystemExit(f"Book not found: {book_path}")
+
+    book = orjson.loads(book_path.read_bytes())
+    data = pack_book(book)
+
+    out_path = Path(args.out) if args.out else book_path.with_suffix(".bin")
+    out_path.write_bytes(data)
+    print(f"Wrote packed book to: {out_path.resolve()}")
+    print(f"Positions: {len(book.get('positions', {}))} size={len(data)} bytes")
+
+
+if __name__ == "__main__":
+    main()
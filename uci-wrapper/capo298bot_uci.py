@@ -2,8 +2,10 @@ import os
 import sys
 import json
 import time
+import selectors
 import subprocess
 import threading
+import chess
 import requests
 
 MOVE_SERVICE_URL = os.getenv("MOVE_SERVICE_URL", "http://localhost:8081/move")
@@ -12,9 +14,10 @@ STOCKFISH_PATH = r"C:\stockfish\stockfish-windows-x86-64-avx2.exe"
 DEFAULT_MOVETIME_MS = int(os.getenv("STOCKFISH_MOVETIME_MS", "250"))
 DEFAULT_MULTIPV = int(os.getenv("STOCKFISH_MULTIPV", "5"))
 
-# UCI wrapper state
-current_fen = "startpos"
-current_moves_uci = []  # list of moves since startpos
+# UCI wrapper state: the current position tracked in-process, so we never
+# have to round-trip through the engine just to learn the FEN
+current_board = chess.Board()
+current_moves_uci = []  # list of moves since startpos/fen
 
 
 def log(msg: str):
@@ -29,28 +32,54 @@ class StockfishUCI:
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
         )
         self.lock = threading.Lock()
+        self._buf = bytearray()
+        # Non-blocking reads with a real timeout where the platform allows it;
+        # selectors can't poll pipes on Windows, so fall back to blocking
+        # readline there (same behavior as before).
+        self._sel = None
+        if sys.platform != "win32":
+            assert self.proc.stdout is not None
+            os.set_blocking(self.proc.stdout.fileno(), False)
+            self._sel = selectors.DefaultSelector()
+            self._sel.register(self.proc.stdout, selectors.EVENT_READ)
         self._init()
 
     def _send(self, cmd: str):
         assert self.proc.stdin is not None
-        self.proc.stdin.write(cmd + "\n")
+        self.proc.stdin.write((cmd + "\n").encode())
         self.proc.stdin.flush()
 
-    def _read_until(self, prefix: str, timeout_s: float = 5.0):
+    def _readline(self, deadline: float):
+        """One stripped line from the engine, or None on timeout/EOF."""
         assert self.proc.stdout is not None
-        start = time.time()
+        while True:
+            i = self._buf.find(b"\n")
+            if i >= 0:
+                line = bytes(self._buf[:i])
+                del self._buf[: i + 1]
+                return line.decode(errors="replace").strip()
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                return None
+            if self._sel is not None:
+                if not self._sel.select(timeout):
+                    return None
+                chunk = os.read(self.proc.stdout.fileno(), 65536)
+            else:
+                chunk = self.proc.stdout.readline()
+            if not chunk:
+                return None
+            self._buf += chunk
+
+    def _read_until(self, prefix: str, timeout_s: float = 5.0):
+        deadline = time.time() + timeout_s
         lines = []
         while True:
-            if time.time() - start > timeout_s:
+            line = self._readline(deadline)
+            if line is None:
                 return lines, None
-            line = self.proc.stdout.readline()
-            if not line:
-                return lines, None
-            line = line.strip()
             lines.append(line)
             if line.startswith(prefix):
                 return lines, line
@@ -91,42 +120,57 @@ def fen_from_position_cmd(cmd: str):
     Supports:
       position startpos moves e2e4 e7e5 ...
       position fen <fen...> moves ...
+    Rebuilds current_board in-process by pushing the move list.
     """
-    global current_fen, current_moves_uci
+    global current_board, current_moves_uci
 
     parts = cmd.split()
     if len(parts) < 2:
         return
 
-    if parts[1] == "startpos":
-        current_fen = "startpos"
-        current_moves_uci = []
-        if "moves" in parts:
-            idx = parts.index("moves")
-            current_moves_uci = parts[idx + 1 :]
-        return
-
-    if parts[1] == "fen":
-        # fen is 6 fields, but lichess-bot will pass a full fen; we take until "moves" if present
-        try:
-            idx_moves = parts.index("moves")
-            fen = " ".join(parts[2:idx_moves])
-            moves = parts[idx_moves + 1 :]
-        except ValueError:
-            fen = " ".join(parts[2:])
+    try:
+        if parts[1] == "startpos":
+            board = chess.Board()
             moves = []
-        current_fen = fen
-        current_moves_uci = moves
+            if "moves" in parts:
+                idx = parts.index("moves")
+                moves = parts[idx + 1 :]
+        elif parts[1] == "fen":
+            # fen is 6 fields, but lichess-bot will pass a full fen; we take until "moves" if present
+            try:
+                idx_moves = parts.index("moves")
+                fen = " ".join(parts[2:idx_moves])
+                moves = parts[idx_moves + 1 :]
+            except ValueError:
+                fen = " ".join(parts[2:])
+                moves = []
+            board = chess.Board(fen)
+        else:
+            return
+
+        for m in moves:
+            board.push_uci(m)
+    except ValueError as e:
+        log(f"bad position cmd ({e}); keeping previous position")
         return
 
+    current_board = board
+    current_moves_uci = moves
+
 
 def ply_from_moves(moves):
     return len(moves)
 
 
+# One keep-alive connection to the move service for the whole game: a fresh
+# TCP connect + teardown per move costs tens of ms, which matters in blitz.
+_session = requests.Session()
+_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+
 def request_book_move(fen: str, ply: int):
     try:
-        r = requests.post(
+        r = _session.post(
             MOVE_SERVICE_URL,
             json={"fen": fen, "ply": ply, "mode": "capo298bot"},
             timeout=1.5,
@@ -139,8 +183,6 @@ def request_book_move(fen: str, ply: int):
 
 
 def main():
-    global current_fen, current_moves_uci
-
     sf = StockfishUCI(STOCKFISH_PATH)
 
     # Basic UCI handshake
@@ -165,33 +207,8 @@ def main():
             continue
 
         if line.startswith("go"):
-            # Determine current fen to send
-            if current_fen == "startpos":
-                # build fen by asking stockfish to apply moves:
-                # simplest: let stockfish handle position startpos moves ...
-                # We'll ask stockfish directly using "position startpos moves ..." by converting to fen is harder.
-                # Instead: use stockfish bestmove with "position startpos moves" is supported by stockfish but our bestmove uses fen.
-                # So we will rebuild fen by asking stockfish itself: we set position startpos moves..., then use "d" to get fen.
-                # We'll do an internal trick: create a fen via stockfish using "position startpos moves ..." and "d"
-                with sf.lock:
-                    sf._send("position startpos" + ((" moves " + " ".join(current_moves_uci)) if current_moves_uci else ""))
-                    sf._send("d")
-                    # read until a line that starts with "Fen:"
-                    assert sf.proc.stdout is not None
-                    fen_line = ""
-                    start = time.time()
-                    while time.time() - start < 2.0:
-                        out = sf.proc.stdout.readline()
-                        if not out:
-                            break
-                        out = out.strip()
-                        if out.startswith("Fen:"):
-                            fen_line = out
-                            break
-                    fen_to_use = fen_line.replace("Fen:", "").strip() if fen_line else ""
-            else:
-                fen_to_use = current_fen
-
+            # Position is tracked in-process; no engine round-trip needed
+            fen_to_use = current_board.fen()
             ply = ply_from_moves(current_moves_uci)
 
             move, source, conf = request_book_move(fen_to_use, ply)